@@ -13,6 +13,13 @@ setup(
     author_email="yuriybash@gmail.com",
     url="",
     tests_require=tests_require,
+    extras_require={
+        'speedups': [
+            'orjson; python_version >= "3"',
+            'ijson<3; python_version < "3"',
+            'ijson; python_version >= "3"',
+        ]
+    },
     install_requires=[
         'python-dateutil', 'requests'
     ],
@@ -1,11 +1,10 @@
-import copy
 import datetime
 import mock
-import json
-import uuid
-import requests
+import threading
+import time
 import unittest
 
+from todoable import api
 from todoable.api import ToDoableClient
 from todoable.lib import (
     AuthenticationError,
@@ -14,40 +13,106 @@ from todoable.lib import (
     NotFoundException,
     RateLimitException,
     InternalServerException,
+    json_dumps,
+    MalformedResponseException,
     ToDoableException,
+    TOKEN_REFRESH_BUFFER,
     TOKEN_TTL,
 )
 from todoable.models import List, ListItem
-from util import create_object_fixture
+from util import create_object_fixture, create_response_fixture, fake_id, FAKE_ID, FAKE_ID2
 
 
 class ClientTest(unittest.TestCase):
 
     def setUp(self):
-        self.client = self._create_client()
-
-    @mock.patch('todoable.api.ToDoableClient.get_token')
-    def _create_client(self, get_token_mock):
-        get_token_mock.return_value = "abcdef", datetime.datetime.utcnow() + datetime.timedelta(seconds=TOKEN_TTL)
-        return ToDoableClient.from_creds("user", "pw")
-
-    @mock.patch('todoable.api.requests.post')
-    def test_from_creds_bad(self, post_mock):
-        resp_mock = mock.Mock()
-        resp_mock.status_code = 401
-        post_mock.return_value = resp_mock
-        with self.assertRaises(AuthenticationError):
-            ToDoableClient.from_creds("bad_user", "bad_pw")
+        api._TOKEN_CACHE.clear()
 
-    @mock.patch('todoable.api.requests.get')
-    def test_make_request_ok(self, get_mock):
-        get_mock.return_value.status_code = 200
-        self.client.make_request(requests.get, '')
-        get_mock.assert_called_once()
+        # swap out network access directly rather than with mock.patch
+        self._orig_post = api.requests.post
+        self.post_mock = api.requests.post = mock.Mock()
+
+        self.client = ToDoableClient.from_token(
+            "abcdef",
+            datetime.datetime.utcnow() + datetime.timedelta(seconds=TOKEN_TTL),
+            username="user",
+            password="pw"
+        )
+        self.request_mock = self.client._session.request = mock.Mock()
 
-    @mock.patch('todoable.api.requests.get')
-    def test_make_request_bad(self, get_mock):
+    def tearDown(self):
+        api.requests.post = self._orig_post
+
+    def test_from_creds_bad(self):
+        self.post_mock.return_value = create_response_fixture(status_code=401)
+        with self.assertRaises(AuthenticationError):
+            ToDoableClient.from_creds("bad_user", "bad_pw")
 
+    def test_get_token_cached(self):
+        expiry = datetime.datetime.utcnow() + datetime.timedelta(seconds=TOKEN_TTL)
+        self.post_mock.return_value = create_response_fixture({
+            'token': 'abcdef', 'expires_at': expiry.isoformat()
+        })
+
+        first = ToDoableClient.get_token("user", "pw")
+        second = ToDoableClient.get_token("user", "pw")
+        self.assertEqual(first, second)
+        self.post_mock.assert_called_once()
+
+        api.invalidate_token("user")
+        ToDoableClient.get_token("user", "pw")
+        self.assertEqual(self.post_mock.call_count, 2)
+
+        for key in api._TOKEN_CACHE:
+            self.assertNotIn("pw", key)
+
+    def test_get_token_expiry_formats(self):
+        for expires_at, expected in [
+            ('2019-03-16T16:28:48.550Z', datetime.datetime(2019, 3, 16, 16, 28, 48, 550000)),
+            ('2019-03-16T16:28:48Z', datetime.datetime(2019, 3, 16, 16, 28, 48)),
+            ('2019-03-16T16:28:48+00:00', datetime.datetime(2019, 3, 16, 16, 28, 48)),
+        ]:
+            self.post_mock.return_value = create_response_fixture({
+                'token': 'abcdef', 'expires_at': expires_at
+            })
+            self.assertEqual(('abcdef', expected), ToDoableClient.get_token("user", "pw"))
+
+    def test_get_token_cache_expiring(self):
+        expiry = datetime.datetime.utcnow() + datetime.timedelta(seconds=1)
+        self.post_mock.return_value = create_response_fixture({
+            'token': 'abcdef', 'expires_at': expiry.isoformat()
+        })
+
+        ToDoableClient.get_token("user", "pw")
+        ToDoableClient.get_token("user", "pw")
+        self.assertEqual(self.post_mock.call_count, 2)
+
+    def test_auth_headers_per_client(self):
+        expiry = datetime.datetime.utcnow() + datetime.timedelta(seconds=TOKEN_TTL)
+        other_client = ToDoableClient.from_token("ghijkl", expiry)
+
+        self.assertNotIn('Authorization', ToDoableClient.HEADERS)
+        self.assertEqual('Token token=abcdef', self.client._session.headers['Authorization'])
+        self.assertEqual('Token token=ghijkl', other_client._session.headers['Authorization'])
+
+    def test_update_token_headers(self):
+        expiry = datetime.datetime.utcnow() + datetime.timedelta(seconds=TOKEN_TTL)
+        self.client.get_token = mock.Mock(return_value=("ghijkl", expiry))
+
+        self.client.update_token()
+        self.assertEqual('Token token=ghijkl', self.client._session.headers['Authorization'])
+        self.assertEqual(expiry, self.client._token_expiry)
+
+    def test_make_request_ok(self):
+        self.request_mock.return_value = create_response_fixture()
+        self.client.make_request('GET', '')
+        self.request_mock.assert_called_once()
+
+    def test_make_request_bad(self):
+
+        # a 401 forces a token refresh on the next request
+        self.client.update_token = mock.Mock()
+        resp_mock = self.request_mock.return_value = create_response_fixture()
         for (status_codes, expected_exception) in [
             [(401, ), AuthenticationError],
             [(400, 422), InvalidRequestException],
@@ -57,26 +122,76 @@ class ClientTest(unittest.TestCase):
             [(600, ), ToDoableException]
         ]:
             for status_code in status_codes:
-                resp_mock = mock.Mock()
                 resp_mock.status_code = status_code
-                get_mock.return_value = resp_mock
                 with self.assertRaises(expected_exception):
-                    self.client.make_request(requests.get, '')
-
-    @mock.patch('todoable.api.requests.get')
-    @mock.patch('todoable.api.ToDoableClient.update_token')
-    def test_refresh_token(self, update_token_mock, get_mock):
-        self.client._token_expiry = datetime.datetime.utcnow() - datetime.timedelta(minutes=2)
-
-        resp_mock = mock.Mock()
-        resp_mock.status_code = 200
-        get_mock.return_value = resp_mock
-        self.client.make_request(requests.get, '')
-        update_token_mock.assert_called_once()
-
-    @mock.patch('todoable.api.ToDoableClient.make_request')
-    def test_get_lists(self, mr_mock):
-        id_ = str(uuid.uuid4())
+                    self.client.make_request('GET', '')
+
+    def test_refresh_token_after_401(self):
+        self.client.update_token = mock.Mock()
+
+        self.request_mock.return_value = create_response_fixture(status_code=401)
+        with self.assertRaises(AuthenticationError):
+            self.client.make_request('GET', '')
+        self.client.update_token.assert_not_called()
+
+        self.request_mock.return_value = create_response_fixture()
+        self.client.make_request('GET', '')
+        self.client.update_token.assert_called_once()
+
+    def test_refresh_token(self):
+        self.client._set_token("abcdef", datetime.datetime.utcnow() - datetime.timedelta(minutes=2))
+        self.client.update_token = mock.Mock()
+
+        self.request_mock.return_value = create_response_fixture()
+        self.client.make_request('GET', '')
+        self.client.update_token.assert_called_once()
+
+    def test_refresh_token_near_expiry(self):
+        self.client.update_token = mock.Mock()
+        self.request_mock.return_value = create_response_fixture()
+
+        self.client.make_request('GET', '')
+        self.client.update_token.assert_not_called()
+
+        self.client._set_token(
+            "abcdef",
+            datetime.datetime.utcnow() + datetime.timedelta(seconds=TOKEN_REFRESH_BUFFER - 1)
+        )
+        self.client.make_request('GET', '')
+        self.client.update_token.assert_called_once()
+
+    def test_refresh_token_once_across_threads(self):
+        expiry = datetime.datetime.utcnow() + datetime.timedelta(seconds=TOKEN_TTL)
+
+        def _get_token(username, password):
+            time.sleep(0.05)
+            return "ghijkl", expiry
+
+        self.client.get_token = mock.Mock(side_effect=_get_token)
+        self.client._set_token("abcdef", datetime.datetime.utcnow() - datetime.timedelta(minutes=2))
+        # Mock's call counting isn't thread-safe, record requests in a list instead
+        requests_made = []
+        self.client._session.request = lambda *args, **kwargs: (
+            requests_made.append(args) or create_response_fixture()
+        )
+
+        threads = [
+            threading.Thread(target=self.client.make_request, args=('GET', ''))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.client.get_token.assert_called_once()
+        self.assertEqual(len(requests_made), len(threads))
+        self.assertEqual('Token token=ghijkl', self.client._session.headers['Authorization'])
+
+    def test_get_lists(self):
+        mr_mock = self.client.make_request = mock.Mock()
+
+        id_ = FAKE_ID
         name = 'my list'
         src = "%s/lists/%s" % (BASE_URL, id_)
 
@@ -84,99 +199,161 @@ class ClientTest(unittest.TestCase):
             'lists': [create_object_fixture(id_, name, src)]
         }
 
-        mocked_response = mock.Mock()
-        mocked_response.json.return_value = mock_json
-        mr_mock.return_value = mocked_response
+        mr_mock.return_value = create_response_fixture(mock_json)
         self.assertEqual(mock_json, self.client.get_lists(raw=True))
 
         list_ = self.client.get_lists()[0]
         self.assertIsInstance(list_, List)
-        serialized_list = copy.copy(list_.__dict__)
+        serialized_list = list_.to_dict()
         serialized_list.pop('items')
         self.assertDictEqual(serialized_list, mock_json['lists'][0])
 
-    @mock.patch('todoable.api.ToDoableClient.make_request')
-    def test_create_list(self, mr_mock):
-
-        id_ = str(uuid.uuid4())
+    def test_get_lists_include_items(self):
+        mr_mock = self.client.make_request = mock.Mock()
+        get_list_mock = self.client.get_list = mock.Mock()
+        list_ids = [fake_id() for _ in range(3)]
+        mr_mock.return_value = create_response_fixture({
+            'lists': [
+                create_object_fixture(id_, 'list %s' % id_, "%s/lists/%s" % (BASE_URL, id_))
+                for id_ in list_ids
+            ]
+        })
+
+        def _get_list(list_id, raw=False):
+            src = "%s/lists/%s/items/%s" % (BASE_URL, list_id, list_id)
+            return {
+                'id': list_id,
+                'items': [create_object_fixture(list_id, 'item', src, item=True)]
+            }
+        get_list_mock.side_effect = _get_list
+
+        lists = self.client.get_lists(include_items=True)
+
+        self.assertEqual(list_ids, [l.id for l in lists])
+        for list_ in lists:
+            self.assertEqual([list_.id], [i.id for i in list_.items])
+        self.assertEqual(get_list_mock.call_count, len(list_ids))
+
+        mr_mock.return_value = create_response_fixture({'lists': []})
+        self.assertEqual([], self.client.get_lists(include_items=True))
+
+    def _check_get_lists_iter(self):
+        mr_mock = self.client.make_request = mock.Mock()
+        list_ids = [fake_id() for _ in range(3)]
+        mock_json = {
+            'lists': [
+                create_object_fixture(id_, 'list %s' % id_, "%s/lists/%s" % (BASE_URL, id_))
+                for id_ in list_ids
+            ]
+        }
+        mock_json['lists'][0]['items'] = [
+            create_object_fixture(FAKE_ID, 'item', '', item=True, finished_at=None)
+        ]
+
+        mr_mock.return_value = create_response_fixture(mock_json)
+        lists = list(self.client.get_lists_iter())
+        self.assertTrue(all(isinstance(l, List) for l in lists))
+        self.assertEqual(list_ids, [l.id for l in lists])
+        self.assertEqual([FAKE_ID], [i.id for i in lists[0].items])
+        mr_mock.assert_called_once_with('GET', api.LISTS_URL, stream=True)
+
+        mr_mock.return_value = create_response_fixture(mock_json)
+        self.assertEqual(mock_json['lists'], list(self.client.get_lists_iter(raw=True)))
+
+        for bad_json in ({}, {'lists': None}):
+            mr_mock.return_value = create_response_fixture(bad_json)
+            with self.assertRaises(MalformedResponseException):
+                list(self.client.get_lists_iter())
+
+    def test_get_lists_iter(self):
+        orig_ijson, api.ijson = api.ijson, None
+        try:
+            self._check_get_lists_iter()
+        finally:
+            api.ijson = orig_ijson
+
+    @unittest.skipIf(api.ijson is None, "ijson not installed")
+    def test_get_lists_iter_streaming(self):
+        self._check_get_lists_iter()
+
+    def test_create_list(self):
+        mr_mock = self.client.make_request = mock.Mock()
+
+        id_ = FAKE_ID
         name = 'my list'
         src = "%s/lists/%s" % (BASE_URL, id_)
 
         mock_json = create_object_fixture(id_, name, src)
-        mocked_response = mock.Mock()
-        mocked_response.json.return_value = mock_json
-        mr_mock.return_value = mocked_response
+        mr_mock.return_value = create_response_fixture(mock_json)
         self.assertEqual(mock_json, self.client.create_list(name, raw=True))
 
-    @mock.patch('todoable.api.ToDoableClient.make_request')
-    def test_update_list(self, mr_mock):
+    def test_update_list(self):
+        mr_mock = self.client.make_request = mock.Mock()
 
-        list_id = str(uuid.uuid4())
+        list_id = FAKE_ID
         new_name = 'updated list name'
 
         self.client.update_list(list_id, new_name)
 
         mr_mock.assert_called_once_with(
-            requests.patch,
+            'PATCH',
             "%s/%s/%s" % (BASE_URL, 'lists', list_id),
-            data=json.dumps({'list': {'name': new_name}})
+            data=json_dumps({'list': {'name': new_name}})
         )
 
-    @mock.patch('todoable.api.ToDoableClient.make_request')
-    def test_delete_list(self, mr_mock):
+    def test_delete_list(self):
+        mr_mock = self.client.make_request = mock.Mock()
 
         list_id = 'list to be deleted'
         self.client.delete_list(list_id)
 
         mr_mock.assert_called_once_with(
-            requests.delete,
+            'DELETE',
             "%s/%s/%s" % (BASE_URL, 'lists', list_id)
         )
 
-    @mock.patch('todoable.api.ToDoableClient.make_request')
-    def test_create_list_item(self, mr_mock):
+    def test_create_list_item(self):
+        mr_mock = self.client.make_request = mock.Mock()
 
-        list_id = str(uuid.uuid4())
+        list_id = FAKE_ID
         item_name = 'my item'
-        item_id = str(uuid.uuid4())
-        src = "%s/%s/%s/%s/%s" % (self.client.BASE_URL, 'lists', list_id, 'items', item_id)
+        item_id = FAKE_ID2
+        src = "%s/%s/%s/%s/%s" % (BASE_URL, 'lists', list_id, 'items', item_id)
 
         mock_json = create_object_fixture(item_id, item_name, src, item=True)
-        mocked_response = mock.Mock()
-        mocked_response.json.return_value = mock_json
-        mr_mock.return_value = mocked_response
+        mr_mock.return_value = create_response_fixture(mock_json)
 
         created = self.client.create_list_item(list_id, item_name)
 
         self.assertIsInstance(created, ListItem)
-        self.assertDictEqual(mock_json, created.__dict__)
+        self.assertDictEqual(mock_json, created.to_dict())
 
         created_raw = self.client.create_list_item(list_id, item_name, raw=True)
         self.assertDictEqual(mock_json, created_raw)
 
-    @mock.patch('todoable.api.ToDoableClient.make_request')
-    def test_delete_list_item(self, mr_mock):
+    def test_delete_list_item(self):
+        mr_mock = self.client.make_request = mock.Mock()
 
         list_id = 'list name'
-        item_id = str(uuid.uuid4())
+        item_id = FAKE_ID
 
         self.client.delete_list_item(list_id, item_id)
 
         mr_mock.assert_called_once_with(
-            requests.delete,
+            'DELETE',
             "%s/%s/%s/%s/%s" % (BASE_URL, 'lists', list_id, 'items', item_id)
         )
 
-    @mock.patch('todoable.api.ToDoableClient.make_request')
-    def test_complete_list_item(self, mr_mock):
+    def test_complete_list_item(self):
+        mr_mock = self.client.make_request = mock.Mock()
 
         list_id = 'list name'
-        item_id = str(uuid.uuid4())
+        item_id = FAKE_ID
 
         self.client.complete_list_item(list_id, item_id)
 
         mr_mock.assert_called_once_with(
-            requests.put,
+            'PUT',
             "%s/%s/%s/%s/%s/%s" % (BASE_URL, 'lists', list_id, 'items', item_id, 'finish')
         )
 
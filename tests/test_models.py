@@ -1,16 +1,15 @@
 from dateutil import parser
 import unittest
-import uuid
 
 from todoable.lib import BASE_URL, MalformedResponseException
 from todoable.models import List, ListItem
-from util import create_object_fixture
+from util import create_object_fixture, FAKE_ID, FAKE_ID2
 
 
 class ListTest(unittest.TestCase):
 
     def test_list_init(self):
-        name, id_ = 'first_list', str(uuid.uuid4())
+        name, id_ = 'first_list', FAKE_ID
         list_ = List(name, id=id_)
         self.assertIsInstance(list_, List)
         self.assertEqual(list_.name, name)
@@ -18,7 +17,7 @@ class ListTest(unittest.TestCase):
 
     def test_list_from_dict_ok(self):
         name = "second_list"
-        id_ = str(uuid.uuid4())
+        id_ = FAKE_ID
         src = "%s/lists/%s" % (BASE_URL, id_)
 
         list_ = List.from_dict(
@@ -30,6 +29,27 @@ class ListTest(unittest.TestCase):
         self.assertEqual(id_, list_.id)
         self.assertEqual(src, list_.src)
 
+    def test_list_to_dict(self):
+        name, id_ = 'third_list', FAKE_ID
+        list_ = List(name, id=id_)
+        self.assertFalse(hasattr(list_, '__dict__'))
+        self.assertDictEqual(
+            {'name': name, 'id': id_, 'items': None, 'src': None},
+            list_.to_dict()
+        )
+
+    def test_list_repr(self):
+        item = ListItem('item', id='2')
+        list_ = List('list {0}', id='1', items=[item])
+        self.assertEqual(
+            "<List: {name = 'list {0}', id = '1', items = [%r], src = None}>" % item,
+            repr(list_)
+        )
+        self.assertEqual(
+            "<ListItem: {name = 'item', id = '2', src = None, finished_at = None}>",
+            repr(item)
+        )
+
     def test_list_from_dict_bad(self):
         with self.assertRaises(MalformedResponseException):
             List.from_dict({"abc": "def"})
@@ -40,7 +60,7 @@ class ListItemTest(unittest.TestCase):
     def list_item_init(self):
 
         name = 'first list item'
-        id_ = str(uuid.uuid4())
+        id_ = FAKE_ID
         item = ListItem(name, id=id_)
         self.assertIsInstance(item, ListItem)
         self.assertEqual(id_, item.id)
@@ -49,8 +69,8 @@ class ListItemTest(unittest.TestCase):
     def test_list_item_from_dict_ok(self):
 
         name = "second list item"
-        id_ = str(uuid.uuid4())
-        src = "%s/lists/%s/items/%s" % (BASE_URL, str(uuid.uuid4()), id_)
+        id_ = FAKE_ID
+        src = "%s/lists/%s/items/%s" % (BASE_URL, FAKE_ID2, id_)
         finished_at = '2019-03-16T16:28:48.550Z'
 
         item = ListItem.from_dict(
@@ -65,6 +85,17 @@ class ListItemTest(unittest.TestCase):
             parser.parse(finished_at).replace(tzinfo=None), item.finished_at
         )
 
+    def test_list_item_from_dict_other_timestamp_format(self):
+
+        finished_at = '2019-03-16T16:28:48+00:00'
+        item = ListItem.from_dict(
+            create_object_fixture(FAKE_ID, 'item', '', item=True, finished_at=finished_at)
+        )
+
+        self.assertEqual(
+            parser.parse(finished_at).replace(tzinfo=None), item.finished_at
+        )
+
     def test_list_item_from_dict_bad(self):
 
         with self.assertRaises(MalformedResponseException):
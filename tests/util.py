@@ -1,3 +1,21 @@
+import io
+import itertools
+import json
+
+# fixed IDs, cheaper than generating uuids in every test
+FAKE_ID = "11111111-1111-1111-1111-111111111111"
+FAKE_ID2 = "22222222-2222-2222-2222-222222222222"
+
+_fake_id_counter = itertools.count()
+
+
+def fake_id():
+    """
+    Unique, uuid-shaped ID for tests that need several distinct IDs
+    """
+    return "00000000-0000-0000-0000-%012d" % next(_fake_id_counter)
+
+
 def create_object_fixture(id_, name, src, item=False, finished_at=None):
     fixture = {
         'id': id_,
@@ -9,3 +27,22 @@ def create_object_fixture(id_, name, src, item=False, finished_at=None):
         fixture['finished_at'] = finished_at
 
     return fixture
+
+
+class FakeResponse(object):
+    """
+    Minimal stand-in for requests.models.Response, much cheaper than a Mock
+    """
+
+    def __init__(self, payload, status_code=200):
+        self.status_code = status_code
+        self.content = json.dumps(payload)
+        self.text = self.content
+        self.raw = io.BytesIO(self.content.encode('utf-8'))
+
+    def close(self):
+        pass
+
+
+def create_response_fixture(payload=None, status_code=200):
+    return FakeResponse(payload or {}, status_code=status_code)
@@ -1,20 +1,36 @@
-import json
+import calendar
+import hashlib
 import logging
 import requests
 import sys
+import threading
+import time
 from datetime import datetime
-from dateutil import parser
+from multiprocessing.pool import ThreadPool
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
 
 from lib import (
     AuthenticationError,
     BASE_URL,
     DEFAULT_HEADERS,
+    ijson,
     InternalServerException,
     InvalidRequestException,
+    json_dumps,
+    json_loads,
+    MalformedResponseException,
+    MAX_RETRIES,
     NotFoundException,
+    ObjectBuilder,
+    parse_timestamp,
+    POOL_SIZE,
     RateLimitException,
+    RETRY_BACKOFF,
+    RETRY_STATUSES,
     TIMEOUT,
     TimeoutException,
+    TOKEN_REFRESH_BUFFER,
     TOKEN_TTL,
     ToDoableException
 )
@@ -23,11 +39,112 @@ from models import List, ListItem
 logging.basicConfig(stream=sys.stdout, level=logging.INFO)
 log = logging.getLogger(__name__)
 
+AUTH_URL = "%s/authenticate" % BASE_URL
+LISTS_URL = "%s/lists" % BASE_URL
+
+# per-endpoint templates, filled with list/item IDs
+_LIST_URL = LISTS_URL + "/%s"
+_ITEMS_URL = _LIST_URL + "/items"
+_ITEM_URL = _ITEMS_URL + "/%s"
+_FINISH_ITEM_URL = _ITEM_URL + "/finish"
+
+# status code -> (exception, message) for non 2xx responses
+_STATUS_EXCEPTIONS = {
+    400: (InvalidRequestException, "Malformed request made"),
+    401: (AuthenticationError, "Error authenticating"),
+    404: (NotFoundException, "Object not found"),
+    422: (InvalidRequestException, "Malformed request made"),
+    429: (RateLimitException, "Too many requests"),
+}
+_SERVER_ERROR = InternalServerException, "Internal Server exception raised"
+_UNKNOWN_ERROR = ToDoableException, "Error reached while making request"
+
+# (username, credentials digest) -> (token, expiry), shared by all clients in
+# the process. the lock only guards the dict, never a network call
+_TOKEN_CACHE = {}
+_TOKEN_CACHE_LOCK = threading.Lock()
+
+
+def _load_json(resp):
+    """
+    Deserialize a response body.
+
+    :param resp: the response
+    :type resp: requests.models.Response
+    :return: the deserialized body
+    :rtype: dict
+    """
+    return json_loads(resp.content)
+
+
+def _iter_json_array(fileobj, key):
+    """
+    Incrementally parse the array under a top-level key of a JSON document,
+    yielding its elements one at a time. Requires `ijson`.
+
+    :param fileobj: file-like object containing the document
+    :type fileobj: file
+    :param key: top-level key of the array
+    :type key: basestring
+    :return: the array's elements
+    :rtype: generator
+    :raises MalformedResponseException: if there is no such array
+    """
+    item_prefix = key + '.item'
+    found = False
+    builder = None
+
+    for prefix, event, value in ijson.parse(fileobj):
+        if builder is not None:
+            builder.event(event, value)
+            if prefix == item_prefix and event in ('end_map', 'end_array'):
+                yield builder.value
+                builder = None
+        elif prefix == key and event == 'start_array':
+            found = True
+        elif prefix == item_prefix:
+            if event in ('start_map', 'start_array'):
+                builder = ObjectBuilder()
+                builder.event(event, value)
+            else:
+                yield value
+
+    if not found:
+        raise MalformedResponseException("Response has no '%s' array" % key)
+
+
+def _token_cache_key(username, password):
+    """
+    Key for the token cache, so that passwords aren't kept around in plaintext.
+
+    :param username: username
+    :type username: basestring
+    :param password: password
+    :type password: basestring
+    :return: (username, sha256 hex digest of the credentials)
+    :rtype: (basestring, basestring)
+    """
+    digest = hashlib.sha256(("%s:%s" % (username, password)).encode('utf-8')).hexdigest()
+    return username, digest
+
+
+def invalidate_token(username):
+    """
+    Drop any cached tokens for a user, e.g. after the server rejected one.
+
+    :param username: username
+    :type username: basestring
+    :return: None
+    :rtype: None
+    """
+    with _TOKEN_CACHE_LOCK:
+        for key in [k for k in _TOKEN_CACHE if k[0] == username]:
+            del _TOKEN_CACHE[key]
+
 
 class ToDoableClient(object):
 
     HEADERS = DEFAULT_HEADERS
-    BASE_URL = BASE_URL
 
     def __init__(self, token, token_expiry, username=None, password=None):
         """
@@ -44,8 +161,6 @@ class ToDoableClient(object):
         :param password: password
         :type password: basestring
         """
-        self._token = token
-        self._token_expiry = token_expiry
         self._username = username
         self._password = password
 
@@ -55,7 +170,24 @@ class ToDoableClient(object):
                 "automatic reauthentication" % TOKEN_TTL
             )
 
-        self.HEADERS.update({'Authorization': 'Token token=%s' % self._token})
+        # a single session keeps connections to the API host alive between requests
+        adapter = HTTPAdapter(
+            pool_connections=POOL_SIZE,
+            pool_maxsize=POOL_SIZE,
+            max_retries=Retry(
+                total=MAX_RETRIES,
+                backoff_factor=RETRY_BACKOFF,
+                status_forcelist=RETRY_STATUSES,
+                raise_on_status=False
+            )
+        )
+        self._session = requests.Session()
+        self._session.headers.update(DEFAULT_HEADERS)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+        self._token_lock = threading.Lock()
+        self._set_token(token, token_expiry)
 
     @classmethod
     def from_creds(cls, username, password):
@@ -99,7 +231,9 @@ class ToDoableClient(object):
     @classmethod
     def get_token(cls, username, password):
         """
-        Get a new token, given a username/pw.
+        Get a token, given a username/pw. A previously fetched token for the
+        same credentials is reused while it has more than
+        `TOKEN_REFRESH_BUFFER` seconds left.
 
         :param username: username
         :type username: basestring
@@ -108,9 +242,14 @@ class ToDoableClient(object):
         :return: token payload and expiration date
         :rtype token: (basestring, datetime.datetime[tz-unaware])
         """
-        url = "%s/%s" % (cls.BASE_URL, 'authenticate')
+        key = _token_cache_key(username, password)
+        with _TOKEN_CACHE_LOCK:
+            cached = _TOKEN_CACHE.get(key)
+        if cached and (cached[1] - datetime.utcnow()).total_seconds() > TOKEN_REFRESH_BUFFER:
+            return cached
+
         resp = requests.post(
-            url,
+            AUTH_URL,
             auth=(username, password),
             headers=cls.HEADERS,
             timeout=TIMEOUT
@@ -118,68 +257,77 @@ class ToDoableClient(object):
 
         if resp.status_code == 401:
             raise AuthenticationError("Unable to authenticate with given username/pw")
-        body = resp.json()
-        token, expiry = body['token'], parser.parse(body['expires_at']).replace(tzinfo=None)
+        body = _load_json(resp)
+        token, expiry = body['token'], parse_timestamp(body['expires_at'])
+        with _TOKEN_CACHE_LOCK:
+            _TOKEN_CACHE[key] = token, expiry
         return token, expiry
 
+    def _set_token(self, token, token_expiry):
+        self._token = token
+        self._token_expiry = token_expiry
+        # unix time after which make_request refreshes the token
+        self._token_expiry_ts = float('inf')
+        if token_expiry:
+            self._token_expiry_ts = (
+                calendar.timegm(token_expiry.utctimetuple()) - TOKEN_REFRESH_BUFFER
+            )
+        self._session.headers['Authorization'] = 'Token token=%s' % token
+
     def update_token(self):
         if not (self._username and self._password):
             raise AuthenticationError("Unable to update token without username and password")
-        self._token, self._token_expiry = self.get_token(self._username, self._password)
+        self._set_token(*self.get_token(self._username, self._password))
 
-    def make_request(self, func, url, headers=None, data=None):
+    def _refresh_expired_token(self):
+        with self._token_lock:
+            # another thread may have refreshed the token while this one waited
+            if self._token and time.time() < self._token_expiry_ts:
+                return
+            self.update_token()
+
+    def make_request(self, method, url, headers=None, data=None, stream=False):
         """
-        Make a request.
+        Make a request. Connections are pooled, and idempotent requests are
+        retried on connection errors and 429/5xx responses.
 
-        :param func: request-making function
-        :type func: callable
+        :param method: HTTP method, e.g. 'GET'
+        :type method: basestring
         :param url: url
         :type url: basestring
-        :param headers: headers to use. if `None`, default headers are used
+        :param headers: extra headers, merged over the client's default and
+            auth headers
         :type headers: dict
         :param data: data to be sent
         :type data: basestring (serialized json)
+        :param stream: whether to defer downloading the response body
+        :type stream: bool
         :return: the response
         :rtype: requests.models.Response
         """
-
-        def _handle_error(bad_resp):
-            """
-            Handle non 2xx response. Raises appropriate exception.
-
-            :param bad_resp: the response
-            :type bad_resp: requests.models.Response
-            :return: None
-            :rtype: None
-            """
-            if bad_resp.status_code == 401:
-                exception, msg = AuthenticationError, "Error authenticating"
-            elif bad_resp.status_code == 404:
-                exception, msg = NotFoundException, "Object not found"
-            elif bad_resp.status_code in (400, 422):
-                exception, msg = InvalidRequestException, "Malformed request made"
-            elif bad_resp.status_code == 429:
-                exception, msg = RateLimitException, "Too many requests"
-            elif 500 <= bad_resp.status_code <= 599:
-                exception, msg = InternalServerException, "Internal Server exception raised"
-            else:
-                exception, msg = ToDoableException, "Error reached while making request"
-
-            raise exception(
-                "%s, status code %s received, body: %s" %
-                (msg, bad_resp.status_code, bad_resp.text)
-            )
-
-        if not self._token or self._token_expiry and datetime.utcnow() >= self._token_expiry:
-            self.update_token()
+        if not self._token or time.time() >= self._token_expiry_ts:
+            self._refresh_expired_token()
 
         try:
-            resp = func(url, headers=headers or self.HEADERS, data=data, timeout=TIMEOUT)
+            resp = self._session.request(
+                method, url, headers=headers, data=data, timeout=TIMEOUT, stream=stream
+            )
         except requests.ConnectionError:
             raise TimeoutException("Timed out while making request")
 
         if not 200 <= resp.status_code <= 299:
-            _handle_error(resp)
+            if resp.status_code == 401 and self._username:
+                # the token was rejected, make the next request fetch a new one
+                invalidate_token(self._username)
+                self._token_expiry_ts = float('-inf')
+
+            exception, msg = _STATUS_EXCEPTIONS.get(resp.status_code) or (
+                _SERVER_ERROR if 500 <= resp.status_code <= 599 else _UNKNOWN_ERROR
+            )
+            raise exception(
+                "%s, status code %s received, body: %s" %
+                (msg, resp.status_code, resp.text)
+            )
         return resp
 
     def get_lists(self, raw=False, include_items=False):
@@ -193,18 +341,54 @@ class ToDoableClient(object):
         :return: the lists, either raw or model instances
         :rtype: [dict] | [List]
         """
-        url = "%s/%s" % (self.BASE_URL, 'lists')
-        serialized = self.make_request(requests.get, url).json()
+        serialized = _load_json(self.make_request('GET', LISTS_URL))
 
         if raw:
             return serialized
 
-        lists = [List.from_dict(l) for l in serialized['lists']]
-        if include_items:
-            for todo_list in lists:
-                items = self.get_list(todo_list.id, raw=True)['items']
-                todo_list.items = [ListItem.from_dict(i) for i in items]
-        return lists
+        list_dicts = serialized['lists']
+        if not (include_items and list_dicts):
+            return [List.from_dict(l) for l in list_dicts]
+
+        def _with_items(list_dict):
+            todo_list = List.from_dict(list_dict)
+            items = self.get_list(todo_list.id, raw=True)['items']
+            todo_list.items = [ListItem.from_dict(i) for i in items]
+            return todo_list
+
+        # build each list and fetch its items in one concurrent pass, bounded
+        # by the connection pool
+        pool = ThreadPool(min(len(list_dicts), POOL_SIZE))
+        try:
+            return pool.map(_with_items, list_dicts)
+        finally:
+            pool.close()
+            pool.join()
+
+    def get_lists_iter(self, raw=False):
+        """
+        Iterate over lists. If `ijson` is installed the response is parsed
+        incrementally, so only one list is held in memory at a time.
+
+        :param raw: whether to yield raw list dicts
+        :type raw: bool
+        :return: the lists, either raw or model instances
+        :rtype: generator of dict | List
+        """
+        resp = self.make_request('GET', LISTS_URL, stream=True)
+        try:
+            if ijson is None:
+                list_dicts = _load_json(resp).get('lists')
+                if not isinstance(list_dicts, list):
+                    raise MalformedResponseException("Response has no 'lists' array")
+            else:
+                resp.raw.decode_content = True
+                list_dicts = _iter_json_array(resp.raw, 'lists')
+
+            for list_dict in list_dicts:
+                yield list_dict if raw else List.from_dict(list_dict)
+        finally:
+            resp.close()
 
     def create_list(self, list_name, raw=False):
         """
@@ -217,15 +401,13 @@ class ToDoableClient(object):
         :return: the list, either raw or model instance
         :rtype: dict | List
         """
-        url = "%s/%s" % (self.BASE_URL, 'lists')
-
         data = {
             "list": {
                 "name": list_name
             }
         }
 
-        serialized = self.make_request(requests.post, url, data=json.dumps(data)).json()
+        serialized = _load_json(self.make_request('POST', LISTS_URL, data=json_dumps(data)))
 
         return serialized if raw else List.from_dict(serialized)
 
@@ -238,8 +420,7 @@ class ToDoableClient(object):
         :return: the list, either raw or model instances
         :rtype: dict | List
         """
-        url = "%s/%s/%s" % (self.BASE_URL, 'lists', list_id)
-        serialized = self.make_request(requests.get, url).json()
+        serialized = _load_json(self.make_request('GET', _LIST_URL % list_id))
         serialized.update({'id': list_id})
 
         if raw:
@@ -261,13 +442,12 @@ class ToDoableClient(object):
         :rtype: None
         """
 
-        url = "%s/%s/%s" % (self.BASE_URL, 'lists', list_id)
         data = {
             "list": {
                 "name": new_name
             }
         }
-        self.make_request(requests.patch, url, data=json.dumps(data))
+        self.make_request('PATCH', _LIST_URL % list_id, data=json_dumps(data))
 
     def delete_list(self, list_id):
         """
@@ -279,8 +459,7 @@ class ToDoableClient(object):
         :rtype: None
         """
 
-        url = "%s/%s/%s" % (self.BASE_URL, 'lists', list_id)
-        self.make_request(requests.delete, url)
+        self.make_request('DELETE', _LIST_URL % list_id)
 
     def create_list_item(self, list_id, item_name, raw=False):
         """
@@ -295,7 +474,6 @@ class ToDoableClient(object):
         :return: raw item or model instance
         :rtype: dict | ListItem
         """
-        url = "%s/%s/%s/%s" % (self.BASE_URL, 'lists', list_id, 'items')
 
         data = {
             "item": {
@@ -303,7 +481,9 @@ class ToDoableClient(object):
             }
         }
 
-        serialized = self.make_request(requests.post, url, data=json.dumps(data)).json()
+        serialized = _load_json(
+            self.make_request('POST', _ITEMS_URL % list_id, data=json_dumps(data))
+        )
         if raw:
             return serialized
         return ListItem.from_dict(serialized)
@@ -319,8 +499,7 @@ class ToDoableClient(object):
         :return: None
         :rtype: None
         """
-        url = "%s/%s/%s/%s/%s/%s" % (self.BASE_URL, 'lists', list_id, 'items', item_id, 'finish')
-        self.make_request(requests.put, url)
+        self.make_request('PUT', _FINISH_ITEM_URL % (list_id, item_id))
 
     def delete_list_item(self, list_id, item_id):
         """
@@ -333,5 +512,4 @@ class ToDoableClient(object):
         :return: None
         :rtype: None
         """
-        url = "%s/%s/%s/%s/%s" % (self.BASE_URL, 'lists', list_id, 'items', item_id)
-        self.make_request(requests.delete, url)
+        self.make_request('DELETE', _ITEM_URL % (list_id, item_id))
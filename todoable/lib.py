@@ -1,4 +1,18 @@
+import _strptime  # strptime imports this lazily, which isn't thread-safe on py2
 import functools
+from datetime import datetime
+from dateutil import parser
+
+try:
+    import orjson as _json  # optional, much faster (de)serialization
+except ImportError:
+    import json as _json
+
+try:
+    import ijson  # optional, incremental parsing of large responses
+    from ijson.common import ObjectBuilder
+except ImportError:
+    ijson = ObjectBuilder = None
 
 BASE_URL = 'http://todoable.teachable.tech/api'
 DEFAULT_HEADERS = {
@@ -6,9 +20,24 @@ DEFAULT_HEADERS = {
     'Content-Type': 'application/json'
 }
 TOKEN_TTL = 20 * 60  # seconds
+TOKEN_REFRESH_BUFFER = 30  # seconds
 
 TIMEOUT = 2  # seconds
 
+json_dumps = _json.dumps
+json_loads = _json.loads
+
+TIMESTAMP_FORMATS = (
+    '%Y-%m-%dT%H:%M:%S.%fZ',  # e.g. 2019-03-16T16:28:48.550Z
+    '%Y-%m-%dT%H:%M:%SZ',
+)
+TIMESTAMP_CACHE_SIZE = 4096
+
+POOL_SIZE = 10  # connections kept alive per host
+MAX_RETRIES = 2
+RETRY_BACKOFF = 0.1  # seconds
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
 
 class ToDoableException(Exception):
     pass
@@ -61,12 +90,48 @@ class NotFoundException(ToDoableException):
     Object not found
     """
 
-def handle_malformed_response(method):
-    @functools.wraps(method)
-    def wrapper(*args, **kwargs):
+
+def memoize(maxsize):
+    """
+    Cache the results of a single-argument function, keyed on the argument.
+    The cache is emptied once it holds `maxsize` entries.
+    """
+    def decorator(func):
+        cache = {}
+
+        @functools.wraps(func)
+        def wrapper(arg):
+            try:
+                return cache[arg]
+            except KeyError:
+                pass
+            if len(cache) >= maxsize:
+                cache.clear()
+            result = cache[arg] = func(arg)
+            return result
+        wrapper.cache_clear = cache.clear
+        return wrapper
+    return decorator
+
+
+def parse_timestamp(value):
+    """
+    Parse a timestamp from the server into a tz-unaware datetime. The
+    server's ISO-8601 formats are parsed directly, anything else falls back
+    to dateutil.
+
+    :param value: the timestamp
+    :type value: basestring
+    :return: the parsed timestamp
+    :rtype: datetime.datetime (tz-unaware)
+    """
+    for format_ in TIMESTAMP_FORMATS:
         try:
-            return method(*args, **kwargs)
-        except KeyError:
-            raise MalformedResponseException(
-                "Error initializing %s instance with data: %s" % (args[0], args[1]))
-    return wrapper
+            return datetime.strptime(value, format_)
+        except ValueError:
+            pass
+    return parser.parse(value).replace(tzinfo=None)
+
+
+# for values that repeat across responses, e.g. items' `finished_at`
+cached_parse_timestamp = memoize(TIMESTAMP_CACHE_SIZE)(parse_timestamp)
@@ -1,7 +1,6 @@
-from dateutil import parser
 import abc
 
-from lib import handle_malformed_response, MalformedResponseException
+from lib import cached_parse_timestamp, MalformedResponseException
 
 
 class ToDoableObject(object):
@@ -10,6 +9,7 @@ class ToDoableObject(object):
     """
 
     __metaclass__ = abc.ABCMeta
+    __slots__ = ()
 
     @abc.abstractmethod
     def from_dict(self, *args, **kwargs):
@@ -17,13 +17,37 @@ class ToDoableObject(object):
         Create an instance of a ToDoableObject subclass from an API response
         """
 
+    def to_dict(self):
+        """
+        Get the object's attributes as a dict.
+
+        :return: attribute name -> value
+        :rtype: dict
+        """
+        return {attr: getattr(self, attr) for attr in self.__slots__}
+
+    @classmethod
+    def _repr_format(cls):
+        """
+        Get the repr format string for the class, built on first use.
+
+        :return: format string with one `{attr!r}` field per slot
+        :rtype: basestring
+        """
+        fmt = cls.__dict__.get('_repr_fmt')
+        if fmt is None:
+            attrs = ', '.join('%s = {%s!r}' % (attr, attr) for attr in cls.__slots__)
+            fmt = cls._repr_fmt = '<%s: {{%s}}>' % (cls.__name__, attrs)
+        return fmt
+
     def __repr__(self):
-        attrs = ("%s = %r" % (k, v) for k, v in self.__dict__.items())
-        return "<%s: {%s}>" % (self.__class__.__name__, ', '.join(attrs))
+        return self._repr_format().format(**self.to_dict())
 
 
 class List(ToDoableObject):
 
+    __slots__ = ('name', 'id', 'items', 'src')
+
     def __init__(self, name, id=None, items=None, src=None):
         """
         Initialize a List object. Note that `items` may be `None` because they
@@ -44,7 +68,6 @@ class List(ToDoableObject):
         self.src = src
 
     @classmethod
-    @handle_malformed_response
     def from_dict(cls, dict_):
         """
         Initialize a List from a server response.
@@ -59,16 +82,22 @@ class List(ToDoableObject):
         if dict_.get('items'):
             items = [ListItem.from_dict(i_dict) for i_dict in dict_['items']]
 
-        return cls(
-            dict_['name'],
-            id=dict_['id'],
-            src=dict_.get('src'),
-            items=items
-        )
+        try:
+            return cls(
+                dict_['name'],
+                id=dict_['id'],
+                src=dict_.get('src'),
+                items=items
+            )
+        except KeyError:
+            raise MalformedResponseException(
+                "Error initializing %s instance with data: %s" % (cls.__name__, dict_))
 
 
 class ListItem(ToDoableObject):
 
+    __slots__ = ('name', 'id', 'src', 'finished_at')
+
     def __init__(self, name, id=None, src=None, finished_at=None):
         """
         Initialize a ListItem.
@@ -89,7 +118,6 @@ class ListItem(ToDoableObject):
         self.finished_at = finished_at
 
     @classmethod
-    @handle_malformed_response
     def from_dict(cls, dict_):
         """
         Initialize a ListItem from a server response.
@@ -100,14 +128,18 @@ class ListItem(ToDoableObject):
         :rtype: ListItem
         """
 
-        finished_at = None
-        if dict_['finished_at']:
-            finished_at = parser.parse(dict_['finished_at']).replace(tzinfo=None)
-
-        return cls(
-            dict_['name'],
-            dict_['id'],
-            dict_['src'],
-            finished_at
-        )
+        try:
+            finished_at = None
+            if dict_['finished_at']:
+                finished_at = cached_parse_timestamp(dict_['finished_at'])
+
+            return cls(
+                dict_['name'],
+                dict_['id'],
+                dict_['src'],
+                finished_at
+            )
+        except KeyError:
+            raise MalformedResponseException(
+                "Error initializing %s instance with data: %s" % (cls.__name__, dict_))
 